@@ -1,3 +1,4 @@
 from .fmnist import *
 from .mnist import *
 from .permutedmnist import *
+from .prefetcher import *
@@ -0,0 +1,112 @@
+from torch.utils.data import Dataset
+import torch
+import os
+
+
+class CachedDataset(Dataset):
+    """ In-memory dataset built from preprocessed tensors
+
+    Samples are stored as uint8 and only dequantized when they are fetched
+
+    Args:
+        data (torch.Tensor): uint8 samples
+        targets (torch.Tensor): Labels of the samples
+        name (str): Name of the dataset (for display purposes)
+        mean (float): Mean used for the normalization
+        std (float): Standard deviation used for the normalization
+    """
+
+    def __init__(self, data, targets, name="Dataset", mean=0., std=1.):
+        self.data = data
+        self.targets = targets
+        self.name = name
+        self.mean = mean
+        self.std = std
+
+    def __getitem__(self, index):
+        """ Get an item from the dataset
+
+        Args:
+            index (int): Index of the sample to return
+        """
+        return self.dequantize(self.data[index]), self.targets[index]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f"Dataset {self.name}\n    Number of datapoints: {len(self)}"
+
+    def dequantize(self, data):
+        """ Convert stored samples to normalized float tensors
+
+        Args:
+            data (torch.Tensor): uint8 samples
+        """
+        return dequantize(data, self.mean, self.std)
+
+
+def dequantize(data, mean=0., std=1.):
+    """ Scale uint8 images to [0, 1] and standardize them
+
+    Equivalent to ToTensor followed by Normalize, but done in place on a single float copy
+
+    Args:
+        data (torch.Tensor): uint8 images
+        mean (float): Mean used for the normalization
+        std (float): Standard deviation used for the normalization
+
+    Returns:
+        torch.Tensor: Normalized float images
+    """
+    data = data.float().div_(255)
+    # Skip the identity passes when no standardization is asked for
+    if mean != 0:
+        data.sub_(mean)
+    if std != 1:
+        data.div_(std)
+    return data
+
+
+def cached_load(path, key, builder):
+    """ Load preprocessed tensors from the disk cache, build them if missing
+
+    Cached tensors are memory-mapped from the file instead of being read into new buffers.
+    Delete the cache folder to force the preprocessing to run again
+
+    Args:
+        path (str): Path to save/load dataset
+        key (str): Name of the cache entry
+        builder (function): Function returning the tuple of tensors to cache
+
+    Returns:
+        tuple: (train_x, train_y, test_x, test_y) tensors
+    """
+    cache = os.path.join(path, "_cache", f"{key}.pt")
+    if os.path.exists(cache):
+        return mmap_load(cache)
+    tensors = builder()
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    # Written beside the entry and moved into place, so that an interrupted write never leaves a truncated cache
+    partial = f"{cache}.{os.getpid()}.tmp"
+    torch.save(tensors, partial)
+    os.replace(partial, cache)
+    return tensors
+
+
+def mmap_load(path, map_location=None):
+    """ Load saved tensors memory-mapped from the file, without unpickling arbitrary objects
+
+    PyTorch versions without memory-mapped loading read the whole file instead
+
+    Args:
+        path (str): Path of the saved file
+        map_location (torch.device): Device to load the tensors onto (default: None, where they were saved)
+
+    Returns:
+        object: Loaded tensors
+    """
+    try:
+        return torch.load(path, map_location=map_location, mmap=True, weights_only=True)
+    except TypeError:
+        return torch.load(path, map_location=map_location, weights_only=True)
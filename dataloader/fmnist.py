@@ -1,37 +1,51 @@
-from torchvision import datasets, transforms
-from torch.utils.data import DataLoader
+from torchvision import datasets
+from .tensorloader import TensorLoader
+from .cache import CachedDataset, cached_load
 import torch
 
 
-def fashion_mnist(path, batch_size, num_workers=0):
+def fashion_mnist(path, batch_size, device=None, num_replicas=1, rank=0):
     """ Load Fashion-MNIST dataset
 
+    The uint8 tensors are cached on disk after the first call and normalized batch by batch
+
     Args:
         path (str): Path to save/load dataset
         batch_size (int): Batch size for training
-        num_workers (int): Number of workers for data loading
+        device (torch.device): Device to move the batches to (default: None, batches stay on the host)
+        num_replicas (int): Number of data parallel processes sharing the training and testing sets (default: 1)
+        rank (int): Rank of the process among them (default: 0)
 
     Returns:
-        torch.utils.data.DataLoader: Fashion-MNIST training dataset
-        torch.utils.data.DataLoader: Fashion-MNIST testing dataset
+        TensorLoader: Fashion-MNIST training dataset
+        TensorLoader: Fashion-MNIST testing dataset
     """
     ### NORMALIZATION ###
     mean, std = 0.1307, 0.3081  # As in EWC paper
-    normalisation = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize(mean, std),
-    ])
 
-    ### DOWNLOAD DATASETS ###
-    fashion_mnist_train = datasets.FashionMNIST(
-        root=path, download=True, transform=normalisation, target_transform=None, train=True)
-    fashion_mnist_test = datasets.FashionMNIST(
-        root=path, download=True, transform=normalisation, target_transform=None, train=False)
+    def builder():
+        ### DOWNLOAD DATASETS ###
+        fashion_mnist_train = datasets.FashionMNIST(
+            root=path, download=True, target_transform=None, train=True)
+        fashion_mnist_test = datasets.FashionMNIST(
+            root=path, download=True, target_transform=None, train=False)
+        return (fashion_mnist_train.data.unsqueeze(1), fashion_mnist_train.targets,
+                fashion_mnist_test.data.unsqueeze(1), fashion_mnist_test.targets)
+
+    ### LOAD DATASETS ###
+    train_x, train_y, test_x, test_y = cached_load(
+        path, "fashion_mnist_uint8", builder)
+    fashion_mnist_train = CachedDataset(
+        train_x, train_y, name="FashionMNIST", mean=mean, std=std)
+    fashion_mnist_test = CachedDataset(
+        test_x, test_y, name="FashionMNIST", mean=mean, std=std)
 
     ### DATA LOADER ###
-    fashion_mnist_train = DataLoader(
-        fashion_mnist_train, batch_size=batch_size, shuffle=True, num_workers=num_workers)
-    fashion_mnist_test = DataLoader(
-        fashion_mnist_test, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    fashion_mnist_train = TensorLoader(
+        fashion_mnist_train, batch_size=batch_size, shuffle=True, drop_last=True, device=device,
+        num_replicas=num_replicas, rank=rank)
+    fashion_mnist_test = TensorLoader(
+        fashion_mnist_test, batch_size=batch_size, shuffle=False, device=device,
+        num_replicas=num_replicas, rank=rank)
 
     return fashion_mnist_train, fashion_mnist_test
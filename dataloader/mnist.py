@@ -1,39 +1,53 @@
-from torchvision import datasets, transforms
-from torch.utils.data import DataLoader
+from torchvision import datasets
+from .tensorloader import TensorLoader
+from .cache import CachedDataset, cached_load
 import PIL.Image as Image
 import torch
 # change get item in mnist to convert first to cpu then to cuda
 
 
-def mnist(path, batch_size, num_workers=0):
+def mnist(path, batch_size, device=None, num_replicas=1, rank=0):
     """ Load MNIST dataset
 
+    The uint8 tensors are cached on disk after the first call and normalized batch by batch
+
     Args:
         path (str): Path to save/load dataset
         batch_size (int): Batch size for training
-        num_workers (int): Number of workers for data loading
+        device (torch.device): Device to move the batches to (default: None, batches stay on the host)
+        num_replicas (int): Number of data parallel processes sharing the training and testing sets (default: 1)
+        rank (int): Rank of the process among them (default: 0)
 
     Returns:
-        torch.utils.data.DataLoader: MNIST training dataset
-        torch.utils.data.DataLoader: MNIST testing dataset
+        TensorLoader: MNIST training dataset
+        TensorLoader: MNIST testing dataset
     """
     ### NORMALIZATION ###
     mean, std = 0.1307, 0.3081  # As in EWC paper
-    normalisation = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize(mean, std)
-    ])
 
-    ### DOWNLOAD DATASETS ###
-    mnist_train = datasets.MNIST(
-        root=path, download=True, transform=normalisation, target_transform=None, train=True)
-    mnist_test = datasets.MNIST(
-        root=path, download=True, transform=normalisation, target_transform=None, train=False)
+    def builder():
+        ### DOWNLOAD DATASETS ###
+        mnist_train = datasets.MNIST(
+            root=path, download=True, target_transform=None, train=True)
+        mnist_test = datasets.MNIST(
+            root=path, download=True, target_transform=None, train=False)
+        return (mnist_train.data.unsqueeze(1), mnist_train.targets,
+                mnist_test.data.unsqueeze(1), mnist_test.targets)
+
+    ### LOAD DATASETS ###
+    train_x, train_y, test_x, test_y = cached_load(
+        path, "mnist_uint8", builder)
+    mnist_train = CachedDataset(
+        train_x, train_y, name="MNIST", mean=mean, std=std)
+    mnist_test = CachedDataset(
+        test_x, test_y, name="MNIST", mean=mean, std=std)
 
     ### DATA LOADER ###
-    mnist_train = DataLoader(
-        mnist_train, batch_size=batch_size, shuffle=True, num_workers=num_workers)
-    mnist_test = DataLoader(
-        mnist_test, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    mnist_train = TensorLoader(
+        mnist_train, batch_size=batch_size, shuffle=True, drop_last=True, device=device,
+        num_replicas=num_replicas, rank=rank)
+    mnist_test = TensorLoader(
+        mnist_test, batch_size=batch_size, shuffle=False, device=device,
+        num_replicas=num_replicas, rank=rank)
 
     return mnist_train, mnist_test
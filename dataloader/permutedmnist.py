@@ -1,5 +1,6 @@
-from torchvision import datasets, transforms
-from torch.utils.data import DataLoader
+from torchvision import datasets
+from .tensorloader import TensorLoader
+from .cache import dequantize
 import torch
 import random
 
@@ -14,9 +15,9 @@ class PermutedMNIST(datasets.MNIST):
     def __init__(self, root="~/.torch/data/mnist", train=True, permute_idx=None):
         super(PermutedMNIST, self).__init__(root, train, download=True)
         assert len(permute_idx) == 28 * 28
-        # Set the permutation
-        self.data = torch.stack([img.float().view(-1)[permute_idx] / 255
-                                 for img in self.data])
+        # Permute the pixels of the whole dataset at once, kept as uint8
+        flat = self.data.view(self.data.shape[0], -1)
+        self.data = torch.index_select(flat, 1, permute_idx)
 
     def __getitem__(self, index):
         """ Get an item from the dataset
@@ -25,9 +26,17 @@ class PermutedMNIST(datasets.MNIST):
             index (int): Index of the sample to return
         """
         # Return the image and the label
-        img, target = self.data[index], self.targets[index]
+        img, target = self.dequantize(self.data[index]), self.targets[index]
         return img, target
 
+    def dequantize(self, data):
+        """ Scale the stored uint8 samples to [0, 1]
+
+        Args:
+            data (torch.Tensor): uint8 samples
+        """
+        return dequantize(data)
+
     def get_sample(self, sample_size):
         """ Get a sample of the dataset
 
@@ -35,38 +44,38 @@ class PermutedMNIST(datasets.MNIST):
             sample_size (int): Number of samples to return
         """
         sample_idx = random.sample(range(len(self)), sample_size)
-        return [img for img in self.data[sample_idx]]
+        return [img for img in self.dequantize(self.data[sample_idx])]
 
 
-def permuted_mnist(path, batch_size):
+def permuted_mnist(path, batch_size, permute_idx=None, device=None, num_replicas=1, rank=0):
     """ Load Permuted MNIST dataset
 
     Args:
         path (str): Path to save/load dataset
         batch_size (int): Batch size for training
+        permute_idx (torch.Tensor): Permutation of the pixels (default: None, a random one is drawn)
+        device (torch.device): Device to move the batches to (default: None, batches stay on the host)
+        num_replicas (int): Number of data parallel processes sharing the training and testing sets (default: 1)
+        rank (int): Rank of the process among them (default: 0)
 
     Returns:
-        torch.utils.data.DataLoader: Permuted MNIST training dataset
-        torch.utils.data.DataLoader: Permuted MNIST testing dataset
+        TensorLoader: Permuted MNIST training dataset
+        TensorLoader: Permuted MNIST testing dataset
     """
-    ### NORMALIZATION ###
-    mean, std = 0.1307, 0.3081  # As in EWC paper
-    normalisation = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize(mean, std)
-    ])
-
     ### DOWNLOAD DATASETS ###
-    permute_idx = torch.randperm(28 * 28)
+    if permute_idx is None:
+        permute_idx = torch.randperm(28 * 28)
     permuted_mnist_train = PermutedMNIST(
         root=path, train=True, permute_idx=permute_idx)
     permuted_mnist_test = PermutedMNIST(
         root=path, train=False, permute_idx=permute_idx)
 
     ### DATA LOADER ###
-    permuted_mnist_train = DataLoader(
-        permuted_mnist_train, batch_size=batch_size, shuffle=True)
-    permuted_mnist_test = DataLoader(
-        permuted_mnist_test, batch_size=batch_size, shuffle=False)
+    permuted_mnist_train = TensorLoader(
+        permuted_mnist_train, batch_size=batch_size, shuffle=True, drop_last=True, device=device,
+        num_replicas=num_replicas, rank=rank)
+    permuted_mnist_test = TensorLoader(
+        permuted_mnist_test, batch_size=batch_size, shuffle=False, device=device,
+        num_replicas=num_replicas, rank=rank)
 
     return permuted_mnist_train, permuted_mnist_test
@@ -0,0 +1,66 @@
+import torch
+
+
+class CUDAPrefetcher:
+    """ Prefetch the batches of a loader onto the device
+
+    On CUDA, the copy of the next batch is issued on a side stream while the current batch is
+    being used, and the compute stream waits on it before using the batch. On other devices the
+    batches are simply moved to the device.
+
+    Args:
+        loader (iterable): Loader yielding (inputs, targets) batches
+        device (torch.device): Device to move the batches to
+        stream (torch.cuda.Stream): Side stream of the copies, to share one between the prefetchers
+            (default: None, a new stream on CUDA)
+    """
+
+    def __init__(self, loader, device, stream=None):
+        self.loader = loader
+        self.dataset = getattr(loader, "dataset", None)
+        self.num_replicas = getattr(loader, "num_replicas", 1)
+        self.device = torch.device(device)
+        if stream is None and self.device.type == "cuda":
+            stream = torch.cuda.Stream(device=self.device)
+        self.stream = stream
+
+    def __len__(self):
+        return len(self.loader)
+
+    def set_epoch(self, epoch, seed=None):
+        """ Forward the epoch and seed to the loader, for the loaders shuffling in step across replicas
+        """
+        if hasattr(self.loader, "set_epoch"):
+            self.loader.set_epoch(epoch, seed)
+
+    def _preload(self):
+        """ Issue the copy of the next batch on the side stream
+
+        The batch is also fetched on the side stream, so loaders that already copy to the device stay off the
+        compute stream
+        """
+        with torch.cuda.stream(self.stream):
+            try:
+                inputs, targets = next(self._iterator)
+            except StopIteration:
+                self._next = None
+                return
+            self._next = (inputs.to(self.device, non_blocking=True),
+                          targets.to(self.device, non_blocking=True))
+
+    def __iter__(self):
+        if self.stream is None:
+            for inputs, targets in self.loader:
+                yield inputs.to(self.device), targets.to(self.device)
+            return
+        self._iterator = iter(self.loader)
+        self._preload()
+        while self._next is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(self.stream)
+            inputs, targets = self._next
+            # The batches were allocated on the side stream but are used on the current one
+            inputs.record_stream(current_stream)
+            targets.record_stream(current_stream)
+            self._preload()
+            yield inputs, targets
@@ -0,0 +1,108 @@
+import torch
+
+
+class TensorLoader:
+    """ Batch iterator over an in-memory dataset
+
+    Batches are contiguous slices of the data. When shuffling, the whole dataset is permuted once per epoch
+    into a scratch buffer instead of gathering scattered samples for every batch. Only the sliced batch is
+    dequantized by the dataset, the stored data stays in its compact format. When a device is given, the
+    compact batch is copied first and dequantized on the device. For CUDA devices, the batches are sliced
+    from page-locked memory so that the copies are asynchronous.
+
+    Args:
+        dataset (torch.utils.data.Dataset): Dataset exposing data and targets tensors and a dequantize method
+        batch_size (int): Batch size
+        shuffle (bool): Whether to shuffle the dataset at every epoch
+        drop_last (bool): Whether to drop the last incomplete batch
+        device (torch.device): Device to move the batches to (default: None, batches stay with the data)
+        num_replicas (int): Number of processes sharing the dataset in data parallel training, each one
+            yields every num_replicas-th batch (default: 1)
+        rank (int): Rank of the process among the replicas (default: 0)
+        seed (int): Seed of the shuffle shared by the replicas, offset by the epoch (default: 0)
+    """
+
+    def __init__(self, dataset, batch_size=1, shuffle=False, drop_last=False, device=None, num_replicas=1, rank=0, seed=0):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.device = device
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        self.pin_memory = device is not None and torch.device(
+            device).type == "cuda"
+        self._shuffled_data = None
+        self._shuffled_targets = None
+        self._pinned_data = None
+        self._pinned_targets = None
+        # Event recorded after the last copy, the pinned buffers are not rewritten before it completes
+        self._copied = None
+
+    def __len__(self):
+        if self.drop_last:
+            # Every replica yields the same number of batches, and the leftover ones are dropped
+            return len(self.dataset) // self.batch_size // self.num_replicas
+        n_batches = (len(self.dataset) + self.batch_size - 1) // self.batch_size
+        return len(range(self.rank, n_batches, self.num_replicas))
+
+    def set_epoch(self, epoch, seed=None):
+        """ Set the epoch of the shuffle, so that the replicas draw the same permutation
+
+        Args:
+            epoch (int): Epoch number
+            seed (int): Seed shared by the replicas (default: None, the current seed is kept)
+        """
+        self.epoch = epoch
+        if seed is not None:
+            self.seed = seed
+
+    def __iter__(self):
+        n, batch_size = len(self.dataset), self.batch_size
+        data, targets = self.dataset.data, self.dataset.targets
+        if self.shuffle:
+            # Allocate the scratch buffers once and permute the dataset into them
+            if self._shuffled_data is None:
+                self._shuffled_data = self._empty_like(data)
+                self._shuffled_targets = self._empty_like(targets)
+            if self._copied is not None:
+                self._copied.synchronize()
+            generator = None
+            if self.num_replicas > 1:
+                generator = torch.Generator().manual_seed(self.seed + self.epoch)
+            perm = torch.randperm(n, generator=generator, device=data.device)
+            torch.index_select(data, 0, perm, out=self._shuffled_data)
+            torch.index_select(targets, 0, perm, out=self._shuffled_targets)
+            data, targets = self._shuffled_data, self._shuffled_targets
+        elif self.pin_memory:
+            # Copy the dataset once into page-locked memory
+            if self._pinned_data is None:
+                self._pinned_data = data.pin_memory()
+                self._pinned_targets = targets.pin_memory()
+            data, targets = self._pinned_data, self._pinned_targets
+        # The number of batches is known up front, no bound check is needed per batch
+        for index in range(self.rank, len(self) * self.num_replicas, self.num_replicas):
+            start = index * batch_size
+            batch_data = data[start:start + batch_size]
+            batch_targets = targets[start:start + batch_size]
+            if self.device is not None:
+                batch_data = batch_data.to(self.device, non_blocking=True)
+                batch_targets = batch_targets.to(
+                    self.device, non_blocking=True)
+                if self.pin_memory:
+                    self._copied = torch.cuda.Event()
+                    self._copied.record()
+            yield self.dataset.dequantize(batch_data), batch_targets
+
+    def _empty_like(self, tensor):
+        """ Allocate a buffer like tensor, page-locked when the batches are copied to a CUDA device
+
+        Args:
+            tensor (torch.Tensor): Tensor to mimic
+
+        Returns:
+            torch.Tensor: Uninitialized buffer
+        """
+        return torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=self.pin_memory)
@@ -16,11 +16,20 @@ MIN_LEARNING_RATE = 1e-16
 NAME = "BiNNBayes-metaplasticity"
 N_NETWORKS = 1  # Number of networks to train
 
-DEVICE = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-NUM_WORKERS = 8  # Number of workers for data loading
+### DISTRIBUTED ###
+# Set by torchrun, a plain python launch runs everything in a single process
+WORLD_SIZE = int(os.environ.get("WORLD_SIZE", 1))  # Number of processes
+RANK = int(os.environ.get("RANK", 0))  # Index of this process
+LOCAL_RANK = int(os.environ.get("LOCAL_RANK", 0))  # Index of this process on its host
+
+DEVICE = torch.device(
+    f"cuda:{LOCAL_RANK}" if torch.cuda.is_available() else "cpu")
 N_TASKS = 0  # Number of tasks to train on (permutations of MNIST)
 SEED = 1  # Random seed
 STD = 0.1  # Standard deviation for the initialization of the weights
+COMPILE = True  # Compile the forward pass of the networks with torch.compile
+COMPILE_MODE = "default"  # torch.compile mode, "reduce-overhead" also captures CUDA graphs of the fixed shapes
+AMP_DTYPE = None  # Dtype of the mixed precision training (e.g. torch.bfloat16, or torch.float16 with loss scaling), None for full precision
 
 
 ### PATHS ###
@@ -28,25 +37,42 @@ SAVE_FOLDER = "saved"
 DATASETS_PATH = "datasets"
 
 if __name__ == "__main__":
+    ### PROCESS GROUP ###
+    if WORLD_SIZE > 1:
+        if DEVICE.type == "cuda":
+            torch.cuda.set_device(DEVICE)
+        torch.distributed.init_process_group(
+            "nccl" if DEVICE.type == "cuda" else "gloo")
+        # Let the first process download and cache the datasets before the others read them
+        if RANK != 0:
+            torch.distributed.barrier()
+
     ### SEED ###
+    # Same seed on every process so that the permutations of the tasks agree
     torch.manual_seed(SEED)
 
+    ### BACKENDS ###
+    # Shapes are fixed for the whole run, let cuDNN pick its fastest kernels and use TF32 for the matmuls
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+
     ### LOAD DATASETS ###
-    mnist_train, mnist_test = mnist(DATASETS_PATH, BATCH_SIZE, NUM_WORKERS)
+    mnist_train, mnist_test = mnist(DATASETS_PATH, BATCH_SIZE, device=DEVICE)
     fashion_mnist_train, fashion_mnist_test = fashion_mnist(
-        DATASETS_PATH, BATCH_SIZE, NUM_WORKERS)
+        DATASETS_PATH, BATCH_SIZE, device=DEVICE)
 
-    input_size = mnist_train.dataset.data.shape[1] * \
-        mnist_train.dataset.data.shape[2]
+    input_size = mnist_train.dataset.data[0].numel()
 
     ### PIPELINE ###
     training_pipeline = []
     testing_pipeline = []
 
     if N_TASKS > 1:
-        for i in range(N_TASKS):
+        permutations = [torch.randperm(input_size) for _ in range(N_TASKS)]
+        for permute_idx in permutations:
             permuted_mnist_train, permuted_mnist_test = permuted_mnist(
-                DATASETS_PATH, BATCH_SIZE)
+                DATASETS_PATH, BATCH_SIZE, permute_idx, device=DEVICE)
             training_pipeline.append(permuted_mnist_train)
             testing_pipeline.append(permuted_mnist_test)
 
@@ -56,6 +82,9 @@ if __name__ == "__main__":
 
         N_TASKS = len(training_pipeline)
 
+    if WORLD_SIZE > 1 and RANK == 0:
+        torch.distributed.barrier()
+
     ### NETWORK CONFIGURATION ###
     networks_data = [
         {
@@ -93,9 +122,14 @@ if __name__ == "__main__":
         main_folder = os.path.join(SAVE_FOLDER, data['name'])
         os.makedirs(main_folder, exist_ok=True)
 
+        ### CONFIG SERIALIZATION ###
+        # Built once per configuration instead of letting W&B walk the objects for every network
+        config = to_jsonable(data)
+
         ### ACCURACY INITIALIZATION ###
         accuracies = []
-        for iteration in range(N_NETWORKS):
+        # The networks are independent, each process trains its share of them
+        for iteration in range(RANK, N_NETWORKS, WORLD_SIZE):
 
             ### SEED ###
             torch.manual_seed(SEED + iteration)
@@ -106,14 +140,16 @@ if __name__ == "__main__":
             ### W&B INITIALIZATION ###
             ident = NAME + f" - {data['name']} - {index}"
             wandb.init(project="binarized-neural-networks", entity="kellian-cottart",
-                       config=networks_data[index], name=NAME)
+                       config=config, name=NAME)
 
             ### INSTANTIATE THE TRAINER ###
+            compile_mode = COMPILE_MODE if COMPILE else None
             if data["optimizer"] in [BinarySynapticUncertainty, BayesBiNN]:
                 network = trainer.BayesTrainer(
-                    model=model, **data, device=DEVICE,)
+                    model=model, **data, device=DEVICE, amp_dtype=AMP_DTYPE, compile_mode=compile_mode,)
             else:
-                network = trainer.Trainer(model=model, **data, device=DEVICE,)
+                network = trainer.Trainer(
+                    model=model, **data, device=DEVICE, amp_dtype=AMP_DTYPE, compile_mode=compile_mode,)
 
             ### TRAINING ###
             print(f"Training {data['name']}...")
@@ -138,7 +174,17 @@ if __name__ == "__main__":
                 sub_folder, accuracy_name, ".pt"))
             accuracies.append(accuracy)
 
-        print(f"Exporting visualisation of {data['name']} accuracy...")
-        title = data['name'] + "-tasks"
-        visualize_sequential(title, accuracies, folder=main_folder)
+        if WORLD_SIZE > 1:
+            gathered = [None] * WORLD_SIZE
+            torch.distributed.all_gather_object(gathered, accuracies)
+            accuracies = [accuracy for rank_accuracies in gathered
+                          for accuracy in rank_accuracies]
+
+        if RANK == 0:
+            print(f"Exporting visualisation of {data['name']} accuracy...")
+            title = data['name'] + "-tasks"
+            visualize_sequential(title, accuracies, folder=main_folder)
     wandb.finish()
+
+    if WORLD_SIZE > 1:
+        torch.distributed.destroy_process_group()
@@ -13,6 +13,8 @@ class BayesianNN(DNN):
     """
 
     def _layer_init(self, layers, dropout=False, bias=False):
+        # Bayesian layers with their ReLU flag, built once so that forward does not inspect the layers
+        self.blocks = []
         for i in range(self.n_layers+1):
             # Linear layers with BatchNorm
             if dropout and i != 0:
@@ -21,6 +23,7 @@ class BayesianNN(DNN):
                 layers[i], layers[i+1], bias=bias, device=self.device))
             self.layers.append(torch.nn.BatchNorm1d(
                 layers[i+1], affine=not bias, track_running_stats=True, device=self.device))
+            self.blocks.append((self.layers[-2], i != self.n_layers))
 
     def _weight_init(self, init='normal', std=0.01):
         pass
@@ -29,12 +32,10 @@ class BayesianNN(DNN):
         """Forward propagation of the binarized neural network
         Uses Sign activation function for binarization
         """
-        for layer in self.layers:
-            if isinstance(layer, MetaBayesLinearParallel):
-                x = layer(x, samples)
-            else:
-                # transform the output of the previous layer [samples, n_neurons, n_features] to [n_neurons, n_features] by averaging over the samples
-                x = torch.mean(x, dim=0)
-            if layer is not self.layers[-1] and isinstance(layer, torch.nn.BatchNorm1d):
+        for layer, relu in self.blocks:
+            x = layer(x, samples)
+            # transform the output of the previous layer [samples, n_neurons, n_features] to [n_neurons, n_features] by averaging over the samples
+            x = torch.mean(x, dim=0)
+            if relu:
                 x = torch.nn.functional.relu(x)
         return torch.nn.functional.log_softmax(x, dim=1)
@@ -18,29 +18,93 @@ networks
         std (float): Standard deviation for initialization
         device (str): Device to use for computation (e.g. 'cuda' or 'cpu')
         dropout (bool): Whether to use dropout
+        norm (str): Normalization after each binarized layer, 'batch' (BatchNorm1d, fused with the sign and folded
+            in evaluation) or 'layer' (LayerNorm)
         latent_weights (bool): Whether to use latent weights or not
+        xnor (bool): Whether the hidden binarized layers run an XNOR-popcount product on packed bits in evaluation,
+            identical to the floating point product for nonzero inputs and weights (zeros are packed as -1) but
+            slower on CPU (default: False)
     """
 
     def __init__(self, *args, **kwargs):
         self.latent_weights = kwargs['latent_weights'] if 'latent_weights' in kwargs else True
+        self.xnor = kwargs['xnor'] if 'xnor' in kwargs else False
         super().__init__(*args, **kwargs)
 
     def _layer_init(self, layers, dropout=False, bias=False):
+        # Blocks of (modules, apply_sign) built once so that forward does not inspect the layers
+        self.blocks = []
         for i in range(self.n_layers+1):
+            block = []
             # Linear layers with BatchNorm
             if dropout and i != 0:
                 layers.append(torch.nn.Dropout(p=0.2))
-            self.layers.append(BinarizedLinear(
+            block.append(BinarizedLinear(
                 layers[i], layers[i+1], bias=bias, device=self.device, latent_weights=self.latent_weights))
-            self.layers.append(torch.nn.BatchNorm1d(
-                layers[i+1], affine=not bias, track_running_stats=True, device=self.device))
+            # Sign activation on every block but the output one, fused with the BatchNorm
+            sign = i != self.n_layers
+            block.append(self._norm_layer(
+                layers[i+1], bias, BatchNormSign if sign else torch.nn.BatchNorm1d))
+            self.layers.extend(block)
+            self.blocks.append((block, sign))
+        self.eval_blocks = self._eval_blocks(folded=False)
+
+    def _eval_blocks(self, folded):
+        """ Blocks used in evaluation. Dropout is the identity there and is left out, so are the BatchNorm layers
+        once they are folded into the binarized layers
+
+        Args:
+            folded (bool): Whether the BatchNorm layers are folded
+        """
+        return [([layer for layer in (block[:-1] if folded else block)
+                  if not isinstance(layer, torch.nn.Dropout)], sign)
+                for block, sign in self.blocks]
+
+    def train(self, mode=True):
+        """Set the network in training or evaluation mode
+        In evaluation, the hidden binarized layers receive +-1 inputs and use packed weights with xnor,
+        and every BatchNorm is folded into the output of the binarized layer before it
+        """
+        super().train(mode)
+        # The first layer receives real-valued inputs and stays in floating point
+        if self.xnor:
+            for block, _ in self.blocks[1:]:
+                for layer in block:
+                    if isinstance(layer, BinarizedLinear):
+                        if mode:
+                            layer.unpack_binary_weights()
+                        else:
+                            layer.pack_binary_weights()
+        # Only the BatchNorm is an affine transform in evaluation, the LayerNorm is kept
+        if self.norm == 'batch':
+            for block, _ in self.blocks:
+                linear = next(layer for layer in block
+                              if isinstance(layer, BinarizedLinear))
+                batch_norm = block[-1]
+                if mode:
+                    linear.unfold_batch_norm()
+                else:
+                    linear.fold_batch_norm(batch_norm)
+            if not mode:
+                self.eval_blocks = self._eval_blocks(folded=True)
+        return self
 
     def forward(self, x):
         """Forward propagation of the binarized neural network
         Uses Sign activation function for binarization
         """
-        for layer in self.layers:
-            x = layer(x)
-            if layer is not self.layers[-1] and isinstance(layer, torch.nn.BatchNorm1d):
-                x = Sign.apply(x)
+        if self.training:
+            for block, sign in self.blocks:
+                for layer in block:
+                    x = layer(x)
+                # The BatchNorm of the hidden blocks already applies the sign
+                if sign and self.norm != 'batch':
+                    x = Sign.apply(x)
+            return torch.nn.functional.log_softmax(x, dim=1)
+        for block, sign in self.eval_blocks:
+            for layer in block:
+                x = layer(x)
+            if sign:
+                # The next layer only needs the signs, pack them directly for the XNOR product
+                x = pack_bits(x) if self.xnor else x.sign()
         return torch.nn.functional.log_softmax(x, dim=1)
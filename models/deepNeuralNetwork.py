@@ -6,19 +6,23 @@ class DNN(torch.nn.Module):
     """ Neural Network Base Class
     """
 
-    def __init__(self, layers=[512], init='normal', std=0.01, device='cuda', dropout=False, bias=False, *args, **kwargs):
+    def __init__(self, layers=[512], init='normal', std=0.01, device=None, dropout=False, bias=False, norm='batch', *args, **kwargs):
         """ NN initialization
 
         Args: 
             layers (list): List of layer sizes (including input and output layers)
             init (str): Initialization method for weights
             std (float): Standard deviation for initialization
-            device (str): Device to use for computation (e.g. 'cuda' or 'cpu')
+            device (str): Device to use for computation (e.g. 'cuda' or 'cpu', default: None, the default torch device)
             dropout (bool): Whether to use dropout
+            norm (str): Normalization after each linear layer, 'batch' (BatchNorm1d) or 'layer' (LayerNorm, per sample)
         """
         super(DNN, self).__init__()
+        if norm not in ('batch', 'layer'):
+            raise ValueError(f"Invalid normalization: {norm}")
         self.n_layers = len(layers)-2
         self.device = device
+        self.norm = norm
         self.layers = torch.nn.ModuleList()
         ### LAYER INITIALIZATION ###
         self._layer_init(layers, dropout, bias)
@@ -32,14 +36,44 @@ class DNN(torch.nn.Module):
             dropout (bool): Whether to use dropout
             bias (bool): Whether to use bias
         """
+        # Blocks of (modules, apply_relu) built once so that forward does not inspect the layers
+        self.blocks = []
         for i in range(self.n_layers+1):
+            block = []
             # Linear layers with BatchNorm
             if dropout and i != 0:
-                self.layers.append(torch.nn.Dropout(p=0.2))
-            self.layers.append(torch.nn.Linear(
+                block.append(torch.nn.Dropout(p=0.2))
+            block.append(torch.nn.Linear(
                 layers[i], layers[i+1], bias=bias, device=self.device))
-            self.layers.append(torch.nn.BatchNorm1d(
-                layers[i+1], affine=not bias, track_running_stats=True, device=self.device))
+            block.append(self._norm_layer(layers[i+1], bias))
+            self.layers.extend(block)
+            # ReLU activation on every block but the output one
+            self.blocks.append((block, i != self.n_layers))
+        # Straight sequence of the modules and activations run by forward, kept out of the registered
+        # submodules so that the state dict keys do not change
+        self.sequence = []
+        for block, relu in self.blocks:
+            self.sequence.extend(block)
+            if relu:
+                self.sequence.append(torch.nn.ReLU(inplace=True))
+        # Dropout is the identity in evaluation, leave it out of the sequence
+        self.eval_sequence = [layer for layer in self.sequence
+                              if not isinstance(layer, torch.nn.Dropout)]
+
+    def _norm_layer(self, size, bias=False, batch_norm=torch.nn.BatchNorm1d):
+        """ Build the normalization layer following a linear layer
+
+        Args:
+            size (int): Number of features
+            bias (bool): Whether the linear layer has a bias, the normalization is then not affine
+            batch_norm (type): BatchNorm1d class to use for the 'batch' normalization
+
+        Returns:
+            torch.nn.Module: Normalization layer
+        """
+        if self.norm == 'layer':
+            return torch.nn.LayerNorm(size, elementwise_affine=not bias, device=self.device)
+        return batch_norm(size, affine=not bias, track_running_stats=True, device=self.device)
 
     def _weight_init(self, init='normal', std=0.01):
         """ Initialize weights of each layer
@@ -70,8 +104,6 @@ class DNN(torch.nn.Module):
 
         """
         ### FORWARD PASS ###
-        for layer in self.layers:
+        for layer in self.sequence if self.training else self.eval_sequence:
             x = layer(x)
-            if layer is not self.layers[-1] and isinstance(layer, torch.nn.BatchNorm1d):
-                x = torch.nn.functional.relu(x)
         return torch.nn.functional.log_softmax(x, dim=1)
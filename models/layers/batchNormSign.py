@@ -0,0 +1,72 @@
+import torch
+import torch._dynamo
+from .binarizedLinear import Sign
+
+
+class BatchNormSignFunction(torch.autograd.Function):
+    """ Batch normalization followed by the Sign activation, in training mode
+
+    The batch statistics are given as constants, the backward pass accounts for their dependency on the
+    inputs and fuses the straight-through estimator of the sign with the batch norm gradient, so that
+    only the normalized inputs are kept between the passes
+    """
+
+    @staticmethod
+    def forward(ctx, tensor_input, mean, invstd, weight, bias):
+        normalized = (tensor_input - mean) * invstd
+        output = normalized if weight is None else torch.addcmul(
+            bias, normalized, weight)
+        ctx.save_for_backward(normalized, invstd, weight, bias)
+        return output.sign()
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        normalized, invstd, weight, bias = ctx.saved_tensors
+        output = normalized if weight is None else torch.addcmul(
+            bias, normalized, weight)
+        # Straight-through estimator of the sign
+        grad_output = grad_output.masked_fill(output.abs() > 1.0, 0)
+        grad_weight = grad_bias = None
+        if weight is not None:
+            grad_weight = (grad_output * normalized).sum(0)
+            grad_bias = grad_output.sum(0)
+            grad_normalized = grad_output * weight
+        else:
+            grad_normalized = grad_output
+        grad_input = (grad_normalized
+                      - grad_normalized.mean(0)
+                      - normalized * (grad_normalized * normalized).mean(0)) * invstd
+        return grad_input, None, None, grad_weight, grad_bias
+
+
+class BatchNormSign(torch.nn.BatchNorm1d):
+    """ BatchNorm1d followed by the Sign activation
+
+    Same parameters and buffers as BatchNorm1d. In training, when the forward is compiled, the normalization
+    and the sign run in a single autograd function (see BatchNormSignFunction) that torch.compile fuses.
+    In eager mode its decomposed kernels are slower than the BatchNorm1d one, BatchNorm1d and Sign are used.
+    """
+
+    def forward(self, input):
+        if not self.training:
+            return super().forward(input).sign()
+        if not torch._dynamo.is_compiling():
+            return Sign.apply(super().forward(input))
+        # Same check as BatchNorm1d, the variance of a single sample is zero
+        if input.shape[0] == 1:
+            raise ValueError(
+                f"Expected more than 1 value per channel when training, got input size {input.size()}")
+        # The statistics are computed in single precision, as BatchNorm does under autocast
+        if input.dtype in (torch.float16, torch.bfloat16):
+            input = input.float()
+        with torch.no_grad():
+            var, mean = torch.var_mean(input, dim=0, unbiased=False)
+            invstd = torch.rsqrt(var + self.eps)
+            if self.track_running_stats:
+                self.num_batches_tracked.add_(1)
+                momentum = 1.0 / float(self.num_batches_tracked) \
+                    if self.momentum is None else self.momentum
+                n = input.shape[0]
+                self.running_mean.lerp_(mean, momentum)
+                self.running_var.lerp_(var * n / max(n - 1, 1), momentum)
+        return BatchNormSignFunction.apply(input, mean, invstd, self.weight, self.bias)
@@ -26,8 +26,6 @@ class GaussianWeightParallel:
     def __init__(self, mu, sigma):
         self.mu = mu  # Mean of the distribution
         self.sigma = sigma  # Standard deviation of the distribution
-        self.normal = torch.distributions.Normal(
-            0, 1)  # Standard normal distribution
 
     def sample(self, samples=1):
         """Sample from the Gaussian distribution using the reparameterization trick
@@ -42,9 +40,9 @@ class GaussianWeightParallel:
             # Use the mean value for inference
             return torch.stack((self.mu.T,) * 1)
         else:
-            # Sample from the standard normal and adjust with sigma and mu
-            epsilon = self.normal.sample(
-                (samples, self.sigma.size()[1], self.sigma.size()[0])).to(self.mu.device)
+            # Sample from the standard normal directly on the device of the weights and adjust with sigma and mu
+            epsilon = torch.randn(
+                (samples, self.sigma.size()[1], self.sigma.size()[0]), device=self.mu.device, dtype=self.mu.dtype)
         return torch.stack((self.mu.T,) * samples) + torch.stack((self.sigma.T,) * samples) * epsilon
 
 
@@ -68,8 +66,8 @@ class GaussianBiasParallel(GaussianWeightParallel):
         if samples == 0:
             return torch.stack((self.mu,) * 1)
         else:
-            epsilon = self.normal.sample(
-                (samples, self.sigma.size()[0])).to(self.mu.device)
+            epsilon = torch.randn(
+                (samples, self.sigma.size()[0]), device=self.mu.device, dtype=self.mu.dtype)
         return torch.stack((self.mu,) * samples) + torch.stack((self.sigma,) * samples) * epsilon
 
 
@@ -20,9 +20,80 @@ class Sign(torch.autograd.Function):
         return grad_i
 
 
+def pack_bits(tensor):
+    """ Pack the signs of a tensor into bytes along its last dimension
+
+    Positive values are stored as 1 bits and the others, zeros included, as 0 bits (-1). The last dimension
+    is padded with 1 bits up to a multiple of 8, so that padding never counts as a mismatch.
+
+    Args:
+        tensor (torch.Tensor): Tensor to pack, of shape (..., n)
+
+    Returns:
+        torch.Tensor: uint8 tensor of shape (..., ceil(n / 8))
+    """
+    bits = tensor > 0
+    padding = -bits.shape[-1] % 8
+    if padding:
+        bits = torch.cat(
+            (bits, bits.new_ones(*bits.shape[:-1], padding)), dim=-1)
+    weights = 1 << torch.arange(8, dtype=torch.uint8, device=bits.device)
+    bits = bits.view(*bits.shape[:-1], -1, 8) * weights
+    return bits.sum(-1, dtype=torch.uint8)
+
+
+def popcount(words):
+    """ Count the 1 bits of packed bytes, summed along the last dimension
+
+    Args:
+        words (torch.Tensor): uint8 tensor of shape (..., m)
+
+    Returns:
+        torch.Tensor: Number of 1 bits, of shape (...)
+    """
+    # Bit counting on each byte, unsigned so that shifts are logical
+    x = words - ((words >> 1) & 0x55)
+    x = (x & 0x33) + ((x >> 2) & 0x33)
+    x = (x + (x >> 4)) & 0x0F
+    return x.sum(-1)
+
+
+def xnor_linear(input_words, weight_words, in_features, max_elements=2**24):
+    """ Linear product of +-1 inputs and weights from their packed bits
+
+    The dot product of two +-1 vectors of size n is n - 2 * (number of mismatching signs).
+    The batch is processed in chunks, so that the (chunk, out_features, bytes) temporaries of the
+    XOR and the popcount hold at most max_elements bytes each
+
+    Args:
+        input_words (torch.Tensor): Packed inputs of shape (batch, bytes)
+        weight_words (torch.Tensor): Packed weights of shape (out_features, bytes)
+        in_features (int): Number of unpacked input features
+        max_elements (int): Maximum number of elements of a temporary (default: 2**24)
+
+    Returns:
+        torch.Tensor: Output of shape (batch, out_features)
+    """
+    output = torch.empty((input_words.shape[0], weight_words.shape[0]),
+                         device=input_words.device)
+    chunk_size = max(1, max_elements // weight_words.numel())
+    for start in range(0, input_words.shape[0], chunk_size):
+        mismatches = popcount(torch.bitwise_xor(
+            input_words[start:start + chunk_size].unsqueeze(-2), weight_words))
+        torch.sub(in_features, mismatches, alpha=2,
+                  out=output[start:start + chunk_size])
+    return output
+
+
 class BinarizedLinear(torch.nn.Linear):
     """ Binarized Linear Layer
 
+    In evaluation, once pack_binary_weights has been called, the inputs are expected to be +-1
+    (or already packed with pack_bits) and the layer runs an XNOR-popcount product on bit-packed
+    weights and inputs. The product is identical to the floating point one for nonzero inputs and weights
+    (zeros are packed as -1 while their sign is 0), but slower on CPU, it only saves the memory of the weights. Once fold_batch_norm
+    has been called, the following BatchNorm1d is applied as a scale and shift of the output.
+
     Args:
         latent_weights (bool): Whether to use latent weights or not
     """
@@ -32,20 +103,67 @@ class BinarizedLinear(torch.nn.Linear):
                  out_features: int,
                  bias=False,
                  latent_weights=True,
-                 device='cuda'
+                 device=None
                  ):
         super(BinarizedLinear, self).__init__(
             in_features, out_features, bias=bias, device=device)
         self.latent_weights = latent_weights
+        # Allocated once and updated in place, a compiled forward keeps reading the tensors it was traced with
+        self.register_buffer('packed_weight', torch.empty(
+            (out_features, (in_features + 7) // 8), dtype=torch.uint8, device=device), persistent=False)
+        self.register_buffer('output_scale', torch.empty(
+            out_features, device=device), persistent=False)
+        self.register_buffer('output_shift', torch.empty(
+            out_features, device=device), persistent=False)
+        self.packed = False
+        self.folded = False
+
+    def pack_binary_weights(self):
+        """Pack the signs of the weights for the XNOR-popcount forward"""
+        self.packed_weight.copy_(pack_bits(self.weight.detach()))
+        self.packed = True
+
+    def unpack_binary_weights(self):
+        """Go back to the floating point forward"""
+        self.packed = False
+
+    def fold_batch_norm(self, batch_norm):
+        """Absorb the BatchNorm1d following the layer, in evaluation mode, into an output scale and shift
+
+        Args:
+            batch_norm (torch.nn.BatchNorm1d): Batch normalization applied to the output of the layer
+        """
+        with torch.no_grad():
+            scale = torch.rsqrt(batch_norm.running_var + batch_norm.eps)
+            shift = -batch_norm.running_mean * scale
+            if batch_norm.affine:
+                scale = scale * batch_norm.weight
+                shift = shift * batch_norm.weight + batch_norm.bias
+            self.output_scale.copy_(scale)
+            self.output_shift.copy_(shift)
+        self.folded = True
+
+    def unfold_batch_norm(self):
+        """Let the BatchNorm1d following the layer normalize the output again"""
+        self.folded = False
 
     def forward(self, input):
         """Forward propagation of the binarized linear layer"""
-        if not self.latent_weights:
+        if self.packed and not self.training:
+            words = input if input.dtype == torch.uint8 else pack_bits(input)
+            output = xnor_linear(words, self.packed_weight, self.in_features)
+            if self.bias is not None:
+                output = output + self.bias.sign()
+        elif not self.latent_weights:
             self.weight.data.sign_()
             self.bias.data.sign_() if self.bias is not None else None
-            return torch.nn.functional.linear(input, self.weight, self.bias)
+            output = torch.nn.functional.linear(input, self.weight, self.bias)
+        elif self.bias:
+            output = torch.nn.functional.linear(
+                input, Sign.apply(self.weight), Sign.apply(self.bias))
         else:
-            if self.bias:
-                return torch.nn.functional.linear(input, Sign.apply(self.weight), Sign.apply(self.bias))
-            else:
-                return torch.nn.functional.linear(input, Sign.apply(self.weight))
+            output = torch.nn.functional.linear(input, Sign.apply(self.weight))
+        if self.folded and not self.training:
+            output = torch.addcmul(
+                self.output_shift, output, self.output_scale)
+        return output
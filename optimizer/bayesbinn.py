@@ -19,6 +19,9 @@ class BayesBiNN(torch.optim.Optimizer):
         scale (float): scale of the prior distribution (default: 1)
     """
 
+    # The gradients are taken with torch.autograd.grad in step, the closure only has to return the loss
+    computes_own_gradients = True
+
     def __init__(self,
                  params: params_t,
                  lr: Union[float, torch.Tensor] = 1e-4,
@@ -62,10 +65,17 @@ class BayesBiNN(torch.optim.Optimizer):
         if prior_lambda is None:
             self.state['prior_lambda'] = torch.zeros_like(param)
 
+        ### FLAT PARAMETERS ###
+        # The parameters become views of a single buffer, so that a sample is loaded with one copy
+        self.flat_parameters = param.detach()
+        vector_to_parameters(self.flat_parameters,
+                             self.param_groups[0]['params'])
+
     def update_prior_lambda(self):
         """ Update the prior lambda for continual learning
         """
-        self.state['prior_lambda'] = self.state['lambda']
+        # Lambda is updated in place, the prior keeps its own copy
+        self.state['prior_lambda'].copy_(self.state['lambda'])
 
     def step(self, closure=None):
         """ Perform a single optimization step 
@@ -80,7 +90,8 @@ class BayesBiNN(torch.optim.Optimizer):
         if closure is None:
             raise RuntimeError(
                 'BayesBiNN optimization step requires a closure function')
-        loss = closure()
+        # The MCMC estimate evaluates the loss on its own samples, only the point estimate needs the current one
+        loss = None
 
         self.state['step'] += 1
 
@@ -109,33 +120,36 @@ class BayesBiNN(torch.optim.Optimizer):
             ### OPTIMIZATION STEP ###
             if num_mcmc_samples <= 0:
                 # Point estimate
+                if loss is None:
+                    loss = closure()
                 relaxed_w = torch.tanh(lambda_)
-                vector_to_parameters(relaxed_w, parameters)
+                self.flat_parameters.copy_(relaxed_w)
                 g = parameters_to_vector(torch.autograd.grad(loss, parameters))
             else:
                 # MCMC estimate
-                for _ in range(num_mcmc_samples):
-                    # Gumbel soft-max trick
-                    epsilon = torch.rand_like(mu)
-                    delta = torch.log(epsilon / (1 - epsilon)) / 2
-                    relaxed_w = torch.tanh(
-                        (lambda_ + delta) / temperature)
-                    vector_to_parameters(relaxed_w, parameters)
+                # Gumbel soft-max trick, the noise of all the samples is drawn at once
+                epsilon = torch.rand(
+                    (num_mcmc_samples, *mu.shape), dtype=mu.dtype, device=mu.device)
+                delta = torch.log(epsilon / (1 - epsilon)) / 2
+                relaxed_ws = torch.tanh((lambda_ + delta) / temperature)
+                scales = ((1 - relaxed_ws * relaxed_ws + eps) / temperature /
+                          (1 - mu * mu + eps))
+                for relaxed_w, s in zip(relaxed_ws, scales):
+                    self.flat_parameters.copy_(relaxed_w)
                     # Compute the loss
                     loss = closure()
                     # Compute the gradient
                     g = parameters_to_vector(
                         torch.autograd.grad(loss, parameters))
-                    s = ((1 - relaxed_w * relaxed_w + eps) / temperature /
-                         (1 - mu * mu + eps))
-                    grad.add_(s * g)
+                    grad.addcmul_(s, g)
                 grad.mul_(1 / num_mcmc_samples)
 
-            # Update all parameters
-            self.state['momentum'] = momentum * \
-                beta + grad + scale*(lambda_ - prior_lambda)
+            # Update all parameters in place, the state buffers are allocated once
+            # mu and lambda move with the values of lambda and momentum before the step
+            torch.tanh(lambda_, out=mu)
+            difference = lambda_ - prior_lambda
             bias_correction = 1 - beta ** step
             step_size = lr / bias_correction
-            self.state['lambda'] = lambda_ - step_size * momentum
-            self.state['mu'] = torch.tanh(lambda_)
+            lambda_.sub_(momentum, alpha=step_size)
+            momentum.mul_(beta).add_(grad).add_(difference, alpha=scale)
         return loss
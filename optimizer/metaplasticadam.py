@@ -1,5 +1,6 @@
+import math
 import torch
-from torch.optim.optimizer import params_t, _get_value, _dispatch_sqrt
+from torch.optim.optimizer import params_t, _get_value, _default_to_fused_or_foreach
 from typing import List, Optional, Union, Tuple
 
 
@@ -21,6 +22,8 @@ class MetaplasticAdam(torch.optim.Optimizer):
         amsgrad (bool): whether to use the AMSGrad variant of this
             algorithm from the paper `On the Convergence of Adam and
             Beyond`_
+        foreach (bool): whether to use the multi tensor implementation,
+            used by default when all the parameters are on CUDA
     """
 
     def __init__(self,
@@ -31,7 +34,8 @@ class MetaplasticAdam(torch.optim.Optimizer):
                  eps: float = 1e-8,
                  weight_decay: float = 0,
                  amsgrad: bool = False,
-                 maximize: bool = False,):
+                 maximize: bool = False,
+                 foreach: Optional[bool] = None,):
         if not 0.0 <= lr:
             raise ValueError(f"Invalid learning rate: {lr}")
         if not 0.0 <= metaplasticity:
@@ -46,7 +50,7 @@ class MetaplasticAdam(torch.optim.Optimizer):
             raise ValueError(f"Invalid weight_decay value: {weight_decay}")
 
         defaults = dict(lr=lr, betas=betas, metaplasticity=metaplasticity, eps=eps,
-                        weight_decay=weight_decay, amsgrad=amsgrad, maximize=maximize)
+                        weight_decay=weight_decay, amsgrad=amsgrad, maximize=maximize, foreach=foreach)
         super().__init__(params, defaults)
 
     def __setstate__(self, state):
@@ -58,6 +62,7 @@ class MetaplasticAdam(torch.optim.Optimizer):
         super().__setstate__(state)
         for group in self.param_groups:
             group.setdefault('amsgrad', False)
+            group.setdefault('foreach', None)
         state_values = list(self.state.values())
         step_is_tensor = (len(state_values) != 0) and torch.is_tensor(
             state_values[0]['step'])
@@ -170,11 +175,49 @@ class MetaplasticAdam(torch.optim.Optimizer):
                 weight_decay=group['weight_decay'],
                 eps=group['eps'],
                 maximize=group['maximize'],
+                foreach=group['foreach'],
                 grad_scale=getattr(self, "grad_scale", None),
             )
         return loss
 
 
+def _step_size(step, lr, beta1, beta2):
+    """ Learning rate with the bias corrections of both moments
+
+    Args:
+        step (float): Number of steps taken
+        lr (float): Learning rate
+        beta1 (float): Coefficient of the first moment
+        beta2 (float): Coefficient of the second moment
+
+    Returns:
+        float: Step size
+    """
+    bias_correction1 = 1 - beta1 ** step
+    # Get the bias correction for the second moment
+    bias_correction2_sqrt = math.sqrt(1 - beta2 ** step)
+    return lr * bias_correction2_sqrt / bias_correction1
+
+
+@torch.jit.script
+def metaplastic_exp_avg(param: torch.Tensor, exp_avg: torch.Tensor, metaplasticity: float) -> torch.Tensor:
+    """ Exponential average used to update the weights, scripted so that the pointwise ops are fused
+
+    Where the update pushes the weight further from zero (the binary weight and the exponential average have
+    the same sign), the exponential average is scaled by the metaplastic factor 1 - tanh(m * |W|)^2
+
+    Args:
+        param (torch.Tensor): Weights
+        exp_avg (torch.Tensor): Exponential average of the gradients
+        metaplasticity (float): Metaplasticity value
+
+    Returns:
+        torch.Tensor: Exponential average with the metaplasticity applied
+    """
+    decay = torch.tanh(metaplasticity * param.abs())
+    return torch.where(param.sign() * exp_avg > 0.0, exp_avg * (1 - decay * decay), exp_avg)
+
+
 def adam_metaplasticity(params: List[torch.Tensor],
                         grads: List[torch.Tensor],
                         exp_avgs: List[torch.Tensor],
@@ -191,19 +234,64 @@ def adam_metaplasticity(params: List[torch.Tensor],
                         lr: Union[float, torch.Tensor],
                         weight_decay: float,
                         eps: float,
-                        maximize: bool):
+                        maximize: bool,
+                        foreach: Optional[bool] = None):
     """ Perform a single optimization step
-    Taken from _single_tensor_adam() in PyTorch, updated to support metaplasticity
+    Taken from adam() in PyTorch, dispatches to the single or multi tensor implementation
     """
 
     assert grad_scale is None and found_inf is None
 
+    if foreach is None:
+        _, foreach = _default_to_fused_or_foreach(
+            params, differentiable=False, use_fused=False)
+
     if torch.jit.is_scripting():
         # this assert is due to JIT being dumb and not realizing that the ops below
         # have overloads to handle both float and Tensor lrs, so we just assert it's
         # a float since most people using JIT are using floats
         assert isinstance(lr, float)
 
+    if foreach and not torch.jit.is_scripting():
+        func = _multi_tensor_adam_metaplasticity
+    else:
+        func = _single_tensor_adam_metaplasticity
+
+    func(params,
+         grads,
+         exp_avgs,
+         exp_avg_sqs,
+         max_exp_avg_sqs,
+         state_steps,
+         amsgrad=amsgrad,
+         beta1=beta1,
+         beta2=beta2,
+         metaplasticity=metaplasticity,
+         lr=lr,
+         weight_decay=weight_decay,
+         eps=eps,
+         maximize=maximize)
+
+
+def _single_tensor_adam_metaplasticity(params: List[torch.Tensor],
+                                       grads: List[torch.Tensor],
+                                       exp_avgs: List[torch.Tensor],
+                                       exp_avg_sqs: List[torch.Tensor],
+                                       max_exp_avg_sqs: List[torch.Tensor],
+                                       state_steps: List[torch.Tensor],
+                                       *,
+                                       amsgrad: bool,
+                                       beta1: float,
+                                       beta2: float,
+                                       metaplasticity: float,
+                                       lr: Union[float, torch.Tensor],
+                                       weight_decay: float,
+                                       eps: float,
+                                       maximize: bool):
+    """ Perform a single optimization step, one parameter at a time
+    Taken from _single_tensor_adam() in PyTorch, updated to support metaplasticity
+    """
+    step_sizes = {}
     for i, param in enumerate(params):
         grad = grads[i] if not maximize else -grads[i]
         exp_avg = exp_avgs[i]
@@ -220,10 +308,9 @@ def adam_metaplasticity(params: List[torch.Tensor],
         exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
 
         step = _get_value(step_t)
-        bias_correction1 = 1 - beta1 ** step
-        bias_correction2 = 1 - beta2 ** step
-        # Get the bias correction for the second moment
-        bias_correction2_sqrt = _dispatch_sqrt(bias_correction2)
+        if step not in step_sizes:
+            step_sizes[step] = _step_size(step, lr, beta1, beta2)
+        step_size = step_sizes[step]
         if amsgrad:
             # Maintains the maximum of all 2nd moment running avg. till now
             torch.maximum(
@@ -233,20 +320,68 @@ def adam_metaplasticity(params: List[torch.Tensor],
             denom = (max_exp_avg_sqs[i].sqrt()).add_(eps)
         else:
             denom = (exp_avg_sq.sqrt()).add_(eps)
-        step_size = lr * bias_correction2_sqrt / bias_correction1
         # If the condition for the metaplastic update is met (i.e., the binary weights and the exponential average have the same sign), update the metaplasticity
         if param.data.dim() == 1:
             # Update the bias
             param.data.addcdiv_(exp_avg, denom, value=-step_size)
         else:
-            # Compute the metaplasticity
-            metaplastic_computation = torch.ones_like(
-                param.data) - torch.pow(torch.tanh(torch.mul(metaplasticity, torch.abs(param.data))), 2)
-            # Compute the condition where the metaplasticity is applied
-            metaplastic_condition = torch.mul(
-                torch.sign(param.data), exp_avg) > 0.0
-            # Update the exponential average
-            updated_exp_avg = torch.mul(metaplastic_computation, exp_avg)
             # Update the weights with the metaplasticity
-            param.data.addcdiv_(torch.where(metaplastic_condition,
-                                            updated_exp_avg, exp_avg), denom, value=-step_size)
+            param.data.addcdiv_(metaplastic_exp_avg(
+                param.data, exp_avg, metaplasticity), denom, value=-step_size)
+
+
+def _multi_tensor_adam_metaplasticity(params: List[torch.Tensor],
+                                      grads: List[torch.Tensor],
+                                      exp_avgs: List[torch.Tensor],
+                                      exp_avg_sqs: List[torch.Tensor],
+                                      max_exp_avg_sqs: List[torch.Tensor],
+                                      state_steps: List[torch.Tensor],
+                                      *,
+                                      amsgrad: bool,
+                                      beta1: float,
+                                      beta2: float,
+                                      metaplasticity: float,
+                                      lr: Union[float, torch.Tensor],
+                                      weight_decay: float,
+                                      eps: float,
+                                      maximize: bool):
+    """ Perform a single optimization step on all the parameters at once
+    Taken from _multi_tensor_adam() in PyTorch, updated to support metaplasticity
+    """
+    if len(params) == 0:
+        return
+    params = [param.data for param in params]
+
+    if maximize:
+        grads = torch._foreach_neg(grads)
+
+    # Update steps
+    torch._foreach_add_(state_steps, 1)
+    if weight_decay != 0:
+        grads = torch._foreach_add(grads, params, alpha=weight_decay)
+
+    # Decay the first and second moment running average coefficient
+    torch._foreach_lerp_(exp_avgs, grads, 1 - beta1)
+    torch._foreach_mul_(exp_avg_sqs, beta2)
+    torch._foreach_addcmul_(exp_avg_sqs, grads, grads, 1 - beta2)
+
+    # The parameters of a group usually share their step, only compute its step size once
+    steps = [_get_value(step_t) for step_t in state_steps]
+    unique_step_sizes = {step: -_step_size(step, lr, beta1, beta2)
+                         for step in set(steps)}
+    step_sizes = [unique_step_sizes[step] for step in steps]
+
+    if amsgrad:
+        # Maintains the maximum of all 2nd moment running avg. till now
+        torch._foreach_maximum_(max_exp_avg_sqs, exp_avg_sqs)
+        # Use the max. for normalizing running avg. of gradient
+        denoms = torch._foreach_sqrt(max_exp_avg_sqs)
+    else:
+        denoms = torch._foreach_sqrt(exp_avg_sqs)
+    torch._foreach_add_(denoms, eps)
+
+    # The biases are updated with the exponential average, the weights with the metaplastic one
+    updates = [exp_avg if param.dim() == 1 else metaplastic_exp_avg(param, exp_avg, metaplasticity)
+               for param, exp_avg in zip(params, exp_avgs)]
+
+    torch._foreach_addcdiv_(params, updates, denoms, step_sizes)
@@ -3,6 +3,9 @@ from .trainer import Trainer
 
 class ClosureTrainer(Trainer):
     """Trainer but with a closure for the optimizer
+    The closure runs the backward pass, unless the optimizer computes the gradients itself
+    (computes_own_gradients, e.g. BayesBiNN). The loss is not scaled, so float16 training is rejected
+    (bfloat16 is supported)
 
     Args:
         Trainer (Trainer): Trainer class to extend
@@ -10,25 +13,33 @@ class ClosureTrainer(Trainer):
         **kwargs: Arbitrary keyword arguments (most likely optimizer or scheduler parameters)
     """
 
+    scales_loss = False
+    accumulates_gradients = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Optimizers reading .grad need the backward pass, the others differentiate the loss themselves
+        self._backward = not getattr(
+            self.optimizer, "computes_own_gradients", False)
+
     def batch_step(self, inputs, targets):
         """Perform the training of a single sample of the batch
+        The batch is expected on the device already, epoch_step prefetches it
         """
+        self.model.train()
+
         def closure():
             # Closure for the optimizer sending the loss to the optimizer
-            self.optimizer.zero_grad()
-            output = self.model.forward(inputs)
-            loss = self.criterion(output, targets)
+            self.optimizer.zero_grad(set_to_none=True)
+            with self._autocast():
+                output = self.parallel_model.forward(inputs)
+                loss = self.criterion(output, targets)
+            if self._backward:
+                loss.backward()
             return loss
 
-        ### FORWARD PASS ###
-        inputs = inputs.view(inputs.shape[0], -1).to(self.device)
-        targets = targets.to(self.device)
-        prediction = self.model.forward(inputs)
-
-        ### LOSS ###
-        self.loss = self.criterion(prediction, targets)
+        inputs = inputs.view(inputs.shape[0], -1)
 
-        ### BACKWARD PASS ###
-        self.optimizer.zero_grad()
-        self.loss.backward()
-        self.optimizer.step(closure=closure)
+        ### OPTIMIZATION STEP ###
+        # The optimizer runs the forward passes through the closure
+        self.loss = self.optimizer.step(closure=closure)
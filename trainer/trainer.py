@@ -1,20 +1,89 @@
 from tqdm import trange
+import contextlib
+import os
+import threading
 import torch
 import wandb
+from dataloader.cache import mmap_load
+from dataloader.prefetcher import CUDAPrefetcher
 
 
 class Trainer:
-    """Base class for all trainers."""
+    """Base class for all trainers.
 
-    def __init__(self, model, optimizer, optimizer_parameters, criterion, device, logging=True, *args, **kwargs):
+    Args:
+        amp_dtype (torch.dtype): Dtype of the mixed precision training forward passes, e.g. torch.bfloat16
+            or torch.float16, the loss is then scaled on cuda devices (default: None, full precision)
+        data_parallel (bool): Whether all the processes of the initialized process group train this model together.
+            Training goes through DistributedDataParallel, so the optimizer must read the gradients from .grad
+            (not supported with computes_own_gradients optimizers), the training and testing loaders are expected
+            to be sharded (see TensorLoader num_replicas and rank) so that each process only loads its share
+            (default: False, each process trains its own model)
+        accumulate_steps (int): Number of batches whose gradients are accumulated before each optimizer step,
+            the processes only synchronize the gradients on the last one. The gradients of the batches left over at
+            the end of an epoch are discarded (default: 1, the closure trainers only support 1)
+        compile_mode (str): torch.compile mode of the model forward pass, e.g. "default" or "reduce-overhead"
+            (default: None, eager)
+    """
+
+    # Whether batch_step drives the backward pass through the loss scaler
+    scales_loss = True
+    # Whether batch_step accumulates the gradients of several batches between optimizer steps
+    accumulates_gradients = True
+
+    def __init__(self, model, optimizer, optimizer_parameters, criterion, device, logging=True, amp_dtype=None, data_parallel=False, accumulate_steps=1, compile_mode=None, *args, **kwargs):
+        if amp_dtype == torch.float16 and not self.scales_loss:
+            raise ValueError(
+                f"{type(self).__name__} does not scale the loss, float16 gradients would underflow (use torch.bfloat16)")
+        if accumulate_steps < 1:
+            raise ValueError(f"Invalid accumulate_steps: {accumulate_steps}")
+        if accumulate_steps != 1 and not self.accumulates_gradients:
+            raise ValueError(
+                f"{type(self).__name__} steps the optimizer on every batch, accumulate_steps must be 1")
+        if compile_mode is not None:
+            # Compile the bound forward so that the state dict keys are left untouched
+            model.forward = torch.compile(
+                model.forward, mode=compile_mode, dynamic=False)
         self.model = model
+        self.data_parallel = data_parallel and torch.distributed.is_available(
+        ) and torch.distributed.is_initialized()
         self.optimizer = optimizer(
             self.model.parameters(), **optimizer_parameters)
+        if self.data_parallel and getattr(self.optimizer, "computes_own_gradients", False):
+            # torch.autograd.grad skips the hooks through which DistributedDataParallel all-reduces the gradients
+            raise ValueError(
+                f"{optimizer.__name__} computes its own gradients, which are not synchronized in data parallel training")
+        if self.data_parallel:
+            self.rank = torch.distributed.get_rank()
+            self.world_size = torch.distributed.get_world_size()
+            device_ids = [device] if torch.device(
+                device).type == "cuda" else None
+            self.parallel_model = torch.nn.parallel.DistributedDataParallel(
+                model, device_ids=device_ids)
+            # Seed of the sharded shuffles, drawn once per trainer and shared by the processes
+            seed = torch.randint(2**62, ()).to(device)
+            torch.distributed.broadcast(seed, 0)
+            self._shuffle_seed = int(seed)
+        else:
+            self.parallel_model = model
+            self._shuffle_seed = None
         self.criterion = criterion
         self.device = device
         self.training_accuracy = []
         self.testing_accuracy = []
         self.logging = logging
+        self.amp_dtype = amp_dtype
+        # Float16 gradients underflow without loss scaling, bfloat16 has the range of float32
+        self.scaler = torch.cuda.amp.GradScaler(
+            enabled=amp_dtype == torch.float16 and torch.device(device).type == "cuda")
+        # Side stream of the batch copies, at a high priority so they are not queued behind the compute
+        self.copy_stream = torch.cuda.Stream(device=device, priority=-1) \
+            if torch.device(device).type == "cuda" else None
+        self.accumulate_steps = accumulate_steps
+        self._save_thread = None
+        self._micro_step = 0
+        # Epochs trained over all the fit calls, so that every task draws new permutations
+        self._epoch = 0
         # Scheduler addition
         if "scheduler" in kwargs:
             scheduler = kwargs["scheduler"]
@@ -22,50 +91,110 @@ class Trainer:
             self.scheduler = scheduler(
                 self.optimizer, **scheduler_parameters)
 
+    def _to_device(self, tensor):
+        """Move a tensor to the device of the trainer
+        Batches coming from a device loader or a prefetcher are already there and are returned as is
+        """
+        return tensor.to(self.device, non_blocking=True)
+
+    def _prefetch(self, loader):
+        """Copy the batches of a loader to the device ahead of their use, unless the loader already does
+        """
+        if isinstance(loader, CUDAPrefetcher):
+            return loader
+        return CUDAPrefetcher(loader, self.device, stream=self.copy_stream)
+
+    def _check_sharding(self, loader):
+        """Make sure that a loader is sharded across the processes exactly when they train the model together
+        Without the gradient synchronization, each process would train its own model on a share of the data
+        """
+        num_replicas = getattr(loader, "num_replicas", 1)
+        expected = self.world_size if self.data_parallel else 1
+        if num_replicas != expected:
+            raise ValueError(
+                f"Loader sharded across {num_replicas} processes, expected {expected}")
+
+    def _autocast(self):
+        """Context of the training forward passes, mixed precision when amp_dtype is set
+        """
+        if self.amp_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=torch.device(self.device).type, dtype=self.amp_dtype)
+
     def batch_step(self, inputs, targets):
         """Perform the training of a single sample of the batch
+        The batch is expected on the device already, epoch_step prefetches it
         """
         self.model.train()
         torch.set_grad_enabled(True)
 
-        ### FORWARD PASS ###
-        inputs = inputs.view(inputs.shape[0], -1).to(self.device)
-        targets = targets.to(self.device)
-        prediction = self.model.forward(inputs)
+        self._micro_step += 1
+        boundary = self._micro_step % self.accumulate_steps == 0
+        # The gradients are only all-reduced on the last batch of an accumulation
+        sync = self.parallel_model.no_sync() if self.data_parallel and not boundary \
+            else contextlib.nullcontext()
 
-        ### LOSS ###
-        self.loss = self.criterion(prediction, targets)
+        with sync:
+            ### FORWARD PASS ###
+            inputs = inputs.view(inputs.shape[0], -1)
+            with self._autocast():
+                prediction = self.parallel_model.forward(inputs)
 
-        ### BACKWARD PASS ###
-        self.optimizer.zero_grad()
-        self.loss.backward()
-        self.optimizer.step()
+                ### LOSS ###
+                self.loss = self.criterion(prediction, targets)
+
+            ### BACKWARD PASS ###
+            loss = self.loss if self.accumulate_steps == 1 else self.loss / self.accumulate_steps
+            self.scaler.scale(loss).backward()
+
+        ### OPTIMIZATION STEP ###
+        if boundary:
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+            self.optimizer.zero_grad(set_to_none=True)
 
     def epoch_step(self, train_loader, test_loader=None):
         """Perform the training of a single epoch
         """
+        ### SHUFFLE ###
+        self._check_sharding(train_loader)
+        # The next batch is copied to the device while the current one is trained on
+        train_loader = self._prefetch(train_loader)
+        # Loaders sharded across the processes draw the same permutation for a given epoch
+        train_loader.set_epoch(self._epoch, self._shuffle_seed)
+        self._epoch += 1
+
         ### TRAIN WITH THE WHOLE BATCH ###
-        for i, (inputs, targets) in enumerate(train_loader):
+        # The losses are summed on the device and only read back once the epoch is over
+        loss_sum = torch.zeros((), device=self.device)
+        n_batches = 0
+        for inputs, targets in train_loader:
             self.batch_step(inputs, targets)
+            loss_sum += self.loss.detach()
+            n_batches += 1
+        self.epoch_loss = loss_sum.item() / max(n_batches, 1)
+        # An incomplete accumulation is not carried over to the next epoch or task
+        if self._micro_step % self.accumulate_steps:
+            self.optimizer.zero_grad(set_to_none=True)
+        self._micro_step = 0
 
         ### SCHEDULER ###
-        if "scheduler" in dir(self):
+        if hasattr(self, "scheduler"):
             self.scheduler.step()
 
         ### EVALUATE ###
         if test_loader is not None:
-            self.testing_accuracy.append(
-                [self.test(data) for data in test_loader])
+            self.testing_accuracy.append(self.evaluate(test_loader))
 
         ### LOGGING ###
-        if self.logging:
+        if self.logging and (not self.data_parallel or self.rank == 0):
             self.log()
 
     def log(self):
         """Log the training and testing results for monitoring
         This function is called at the end of each epoch"""
-        # loss
-        wandb.log({"Loss": self.loss.item()})
+        # mean loss of the epoch
+        wandb.log({"Loss": self.epoch_loss})
 
         # training accuracy
         for task in range(len(self.testing_accuracy[-1])):
@@ -93,20 +222,47 @@ class Trainer:
                 kwargs = {
                     f"task {i+1}": f"{accuracy:.2%}" for i, accuracy in enumerate(self.testing_accuracy[-1]) if accuracy is not None
                 }
-                pbar.set_postfix(current_loss=self.loss.item(
-                ), **kwargs, lr=self.optimizer.param_groups[0]['lr'] if "lr" in self.optimizer.param_groups[0] else None)
+                pbar.set_postfix(current_loss=self.epoch_loss, **kwargs, lr=self.optimizer.param_groups[0]['lr'] if "lr" in self.optimizer.param_groups[0] else None)
+
+    def _scaler_path(self, path):
+        """Path of the loss scaler state saved along the model
+        """
+        return os.path.splitext(path)[0] + "_scaler.pt"
 
     def save(self, path):
-        """Save the model
+        """Save the model (and the loss scaler state when float16 training)
+        The weights are copied to the host and written by a background thread, training can go on meanwhile
+        """
+        self.wait_saved()
+        # Host copy of the weights, the model can change once it is taken
+        state_dict = {key: value.detach().to("cpu", non_blocking=True, copy=True)
+                      for key, value in self.model.state_dict().items()}
+        if torch.device(self.device).type == "cuda":
+            torch.cuda.synchronize(self.device)
+        self._save_thread = threading.Thread(
+            target=torch.save, args=(state_dict, path))
+        self._save_thread.start()
+        if self.scaler.is_enabled():
+            torch.save(self.scaler.state_dict(), self._scaler_path(path))
+
+    def wait_saved(self):
+        """Wait for the weights of the last save to be written
         """
-        torch.save(self.model.state_dict(), path)
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
 
     def load(self, path):
-        """Load the model
+        """Load the model (and the loss scaler state when float16 training)
         """
-        self.model.load_state_dict(torch.load(path))
+        self.wait_saved()
+        # Memory-mapped straight onto the device
+        self.model.load_state_dict(mmap_load(path, self.device))
+        if self.scaler.is_enabled() and os.path.exists(self._scaler_path(path)):
+            self.scaler.load_state_dict(
+                mmap_load(self._scaler_path(path), self.device))
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def predict(self, tensor):
         """ Predict labels for data
 
@@ -118,16 +274,16 @@ class Trainer:
             torch.Tensor: Probability of predicted labels
 
         """
-        tensor = tensor.view(1, -1).to(self.device)
-        y_pred = self.model.forward(tensor).to(self.device)
-        # Retrieve the most likely class from the softmax output
-        _, predicted = torch.max(y_pred.data, 1)
-        # Retrieve the probability of the most likely class
-        probability = torch.nn.functional.softmax(
-            y_pred.data, dim=1)[0][predicted]
+        self.model.eval()
+        tensor = self._to_device(tensor.view(1, -1))
+        y_pred = self.model.forward(tensor)
+        # Retrieve the most likely class and its log-probability, the networks output a log-softmax
+        log_probability, predicted = torch.max(y_pred, 1)
+        # Retrieve the probability of the most likely class without a softmax over all the classes
+        probability = log_probability.exp()
         return predicted, probability
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def test(self, dataloader):
         """ Test DNN
 
@@ -138,14 +294,57 @@ class Trainer:
             float: Accuracy of DNN on data
 
         """
+        return self.evaluate([dataloader])[0]
+
+    @torch.inference_mode()
+    def evaluate(self, dataloaders):
+        """ Test DNN on several testing sets
+
+        The counts of all the sets stay on the device and are read back at once
+
+        Args:
+            dataloaders (list): Testing data loaders containing (data, labels) pairs
+
+        Returns:
+            list: Accuracy of DNN on each testing set
+        """
+        if self.data_parallel:
+            # DistributedDataParallel only broadcasts the buffers before its forward passes, every process
+            # evaluates with the running statistics of the saved rank 0 model
+            for buffer in self.model.buffers():
+                torch.distributed.broadcast(buffer, 0)
+        self.model.eval()
         ### ACCURACY COMPUTATION ###
-        correct = 0
+        # A single buffer holds the correct counts of all the sets, the totals are known on the host
+        corrects = torch.zeros(
+            len(dataloaders), dtype=torch.long, device=self.device)
+        totals = [self._count_correct(dataloader, correct)
+                  for dataloader, correct in zip(dataloaders, corrects)]
+        if self.data_parallel:
+            counts = torch.cat(
+                (corrects, torch.tensor(totals, device=self.device)))
+            torch.distributed.all_reduce(counts)
+            corrects, totals = counts.split(len(totals))
+            totals = totals.tolist()
+        return [correct / total for correct, total in zip(corrects.tolist(), totals)]
+
+    def _count_correct(self, dataloader, correct):
+        """ Count the correct predictions on a testing set, without waiting for the device
+
+        Args:
+            dataloader (torch.utils.data.DataLoader): Testing data containing (data, labels) pairs
+            correct (torch.Tensor): Scalar on the device the correct predictions are added to
+
+        Returns:
+            int: Number of predictions
+        """
         total = 0
-        for x, y in dataloader:
-            x = x.view(x.shape[0], -1).to(self.device)
-            y = y.to(self.device)
-            y_pred = self.model.forward(x)
-            _, predicted = torch.max(y_pred.data, 1)
+        # Every process evaluates the share of the batches its sharded loader yields
+        self._check_sharding(dataloader)
+        for x, y in self._prefetch(dataloader):
+            x = x.view(x.shape[0], -1)
+            # Only the most likely class is needed, not its score
+            predicted = self.model.forward(x).argmax(dim=1)
             total += y.size(0)
-            correct += (predicted == y).sum().item()
-        return correct/total
+            correct += (predicted == y).sum()
+        return total
@@ -1 +1,2 @@
 from .visual import *
+from .config import *
@@ -0,0 +1,18 @@
+def to_jsonable(data):
+    """ Convert a configuration to plain python types that can be serialized
+
+    Args:
+        data: Configuration (nested dicts, lists, classes, objects...)
+
+    Returns:
+        Configuration made of dicts, lists, strings and numbers
+    """
+    if isinstance(data, dict):
+        return {str(key): to_jsonable(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [to_jsonable(value) for value in data]
+    if data is None or isinstance(data, (bool, int, float, str)):
+        return data
+    if isinstance(data, type):
+        return data.__name__
+    return str(data)